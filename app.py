@@ -1,120 +1,864 @@
+import time
+
+PROCESS_STARTED = time.perf_counter()
+
+import io
+import os
+import sys
+import csv
+import json
+import codecs
+import math
+import zlib
+import hmac
+import heapq
+import pstats
+import random
+import cProfile
+import itertools
 import sqlite3
-import telebot
+import shutil
 import threading
 import schedule
-import time
-from datetime import datetime
-from telebot import types
-from flask import Flask, request, jsonify
+from collections import OrderedDict
+from datetime import date, datetime
+from flask import Flask, Response, g, request, jsonify, stream_with_context
 from flask_cors import CORS
+from werkzeug.serving import make_server
 
 app = Flask(__name__)
 CORS(app, resources={r"/*": {"origins": "*"}})
-bot = telebot.TeleBot(ENTER_BOT_TOKEN)
+BOT_TOKEN = os.environ.get('BOT_TOKEN', 'ENTER_BOT_TOKEN')
 USER_IDS = set()
 HOST = '0.0.0.0'
 PORT = 5000
+DB_PATH = 'tasks.db'
+SHARD_STATE_PATH = 'shards.json'
+SHARD_ID_SPAN = 2 ** 40
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_KEEP = 20
+PROFILE_MAX_STATEMENTS = 200
+PROFILE_STATS_LINES = 30
+# (tokens per second, burst) for each bucket kind
+RATE_LIMITS = {
+    ('user', 'read'): (10, 40),
+    ('user', 'write'): (3, 20),
+    ('ip', 'read'): (30, 120),
+    ('ip', 'write'): (10, 60),
+}
+RATE_LIMIT_MAX_KEYS = 100000
+RATE_LIMIT_EXEMPT_PATHS = {'/', '/health', '/favicon.ico'}
+MAX_CONCURRENT_REQUESTS = 16
+REQUEST_QUEUE_TIMEOUT = 2
+REMINDER_DUE_SOON_DAYS = 1
+REMINDER_DIGEST_MAX_TASKS = 20
+BACKUP_DIR = 'backups'
+BACKUP_KEEP = 14
+BACKUP_INTERVAL_HOURS = 6
+BACKUP_PAGES_PER_STEP = 256
+BACKUP_STEP_SLEEP = 0.05
+BACKUP_MAX_RESTARTS = 3
+BACKUP_PARTIAL_MAX_AGE = 24 * 60 * 60
+
+_shard_state = {'mtime': None, 'count': 1, 'previous': None}
+_shard_state_lock = threading.Lock()
+
+_bot = None
+_bot_lock = threading.Lock()
+
+
+def get_bot():
+    # telebot is imported and the bot built on first use, so importing app.py stays side-effect free
+    global _bot
+    if _bot is None:
+        with _bot_lock:
+            if _bot is None:
+                import telebot
+                new_bot = telebot.TeleBot(BOT_TOKEN)
+                new_bot.register_message_handler(start, commands=['start'])
+                _bot = new_bot
+    return _bot
+
+
+_profile_local = threading.local()
+# only one cProfile profiler can run at a time, concurrent samples record timing and SQL only
+_profiler_lock = threading.Lock()
+_slow_profiles = []
+_slow_profiles_lock = threading.Lock()
+_profile_counter = itertools.count()
+
+
+def start_profile(name, force=False):
+    if not force and (PROFILE_SAMPLE_RATE <= 0 or random.random() >= PROFILE_SAMPLE_RATE):
+        return None
+
+    profile = {'name': name, 'started': time.perf_counter(), 'sql': [], 'profiler': None}
+    if _profiler_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        profiler.enable()
+        profile['profiler'] = profiler
+    _profile_local.current = profile
+    return profile
+
+
+def finish_profile(profile):
+    duration = time.perf_counter() - profile['started']
+    _profile_local.current = None
+
+    profiler = profile['profiler']
+    if profiler:
+        profiler.disable()
+        _profiler_lock.release()
+
+    # _slow_profiles is a min-heap, so the fastest kept profile is the one to beat
+    with _slow_profiles_lock:
+        if len(_slow_profiles) >= PROFILE_KEEP and duration <= _slow_profiles[0][0]:
+            return
+
+    stats_text = None
+    if profiler:
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(PROFILE_STATS_LINES)
+        stats_text = stream.getvalue()
+
+    entry = {
+        'name': profile['name'],
+        'duration_ms': round(duration * 1000, 2),
+        'recorded_at': datetime.now().isoformat(timespec='seconds'),
+        'sql': profile['sql'],
+        'profile': stats_text
+    }
+    with _slow_profiles_lock:
+        heapq.heappush(_slow_profiles, (duration, next(_profile_counter), entry))
+        if len(_slow_profiles) > PROFILE_KEEP:
+            heapq.heappop(_slow_profiles)
+
+
+def get_slow_profiles():
+    with _slow_profiles_lock:
+        return [entry for _, _, entry in sorted(_slow_profiles, reverse=True)]
+
+
+def run_profiled(name, func):
+    profile = start_profile(name)
+    try:
+        return func()
+    finally:
+        if profile:
+            finish_profile(profile)
 
 
-def init_database():
+def trace_sql(statement):
+    profile = getattr(_profile_local, 'current', None)
+    if profile and len(profile['sql']) < PROFILE_MAX_STATEMENTS:
+        elapsed_ms = round((time.perf_counter() - profile['started']) * 1000, 2)
+        profile['sql'].append({'at_ms': elapsed_ms, 'statement': statement})
+
+
+_rate_buckets = {}
+_rate_buckets_lock = threading.Lock()
+_request_slots = threading.BoundedSemaphore(MAX_CONCURRENT_REQUESTS)
+
+
+def prune_rate_buckets(now):
+    # buckets that have refilled to their burst size carry no state and can be dropped
+    for key in list(_rate_buckets):
+        tokens, updated = _rate_buckets[key]
+        rate, burst = RATE_LIMITS[key[:2]]
+        if tokens + (now - updated) * rate >= burst:
+            del _rate_buckets[key]
+
+
+def take_rate_tokens(keys):
+    '''Take one token from every bucket in keys, or none of them.
+
+    Returns 0 when the request is allowed, otherwise the seconds to wait before retrying.
+    '''
+    now = time.monotonic()
+    with _rate_buckets_lock:
+        if len(_rate_buckets) > RATE_LIMIT_MAX_KEYS:
+            prune_rate_buckets(now)
+
+        retry_after = 0
+        refilled = {}
+        for key in keys:
+            rate, burst = RATE_LIMITS[key[:2]]
+            tokens, updated = _rate_buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            refilled[key] = tokens
+            if tokens < 1:
+                retry_after = max(retry_after, (1 - tokens) / rate)
+
+        if retry_after:
+            return retry_after
+
+        for key, tokens in refilled.items():
+            _rate_buckets[key] = (tokens - 1, now)
+        return 0
+
+
+def connect_shard(index):
+    conn = sqlite3.connect(shard_path(index))
+    if getattr(_profile_local, 'current', None):
+        conn.set_trace_callback(trace_sql)
+    return conn
+
+
+def get_shard_state():
+    # shards.json is rewritten by the reshard tool while the API is running,
+    # so re-read it whenever its mtime changes
+    try:
+        mtime = os.stat(SHARD_STATE_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return 1, None
+
+    with _shard_state_lock:
+        if mtime != _shard_state['mtime']:
+            with open(SHARD_STATE_PATH) as f:
+                data = json.load(f)
+            _shard_state['mtime'] = mtime
+            _shard_state['count'] = int(data.get('count', 1))
+            _shard_state['previous'] = data.get('previous')
+        return _shard_state['count'], _shard_state['previous']
+
+
+def get_shard_state_mtime():
+    try:
+        return os.stat(SHARD_STATE_PATH).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def save_shard_state(count, previous=None):
+    data = {'count': count}
+    if previous:
+        data['previous'] = previous
+    tmp_path = SHARD_STATE_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, SHARD_STATE_PATH)
+
+
+def shard_path(index):
+    if index == 0:
+        return DB_PATH
+    root, ext = os.path.splitext(DB_PATH)
+    return f"{root}_{index}{ext}"
+
+
+def hash_shard(user_id, count):
+    return zlib.crc32(str(int(user_id)).encode()) % count
+
+
+def has_user_rows(index, user_id):
+    conn = connect_shard(index)
     try:
-        conn = sqlite3.connect('tasks.db')
         cursor = conn.cursor()
+        cursor.execute('''
+            SELECT EXISTS(SELECT 1 FROM tasks WHERE user_id = ?)
+                OR EXISTS(SELECT 1 FROM task_groups WHERE user_id = ?)
+                OR EXISTS(SELECT 1 FROM user_settings WHERE user_id = ?)
+        ''', (int(user_id),) * 3)
+        return bool(cursor.fetchone()[0])
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
 
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='user_settings'")
-        if not cursor.fetchone():
-            cursor.execute('''
-                CREATE TABLE user_settings (
-                    user_id INTEGER PRIMARY KEY,
-                    theme TEXT DEFAULT 'light',
-                    notifications_enabled BOOLEAN DEFAULT 1,
-                    notification_time TEXT DEFAULT '12:00',
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            print("Created user_settings table")
 
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='tasks'")
-        if not cursor.fetchone():
-            cursor.execute('''
-                CREATE TABLE tasks (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    priority TEXT CHECK(priority IN ('low', 'medium', 'high')) DEFAULT 'medium',
-                    start_date DATE,
-                    end_date DATE,
-                    complexity TEXT CHECK(complexity IN ('easy', 'medium', 'hard')) DEFAULT 'medium',
-                    assignee TEXT,
-                    status TEXT CHECK(status IN ('new', 'progress', 'done')) DEFAULT 'new',
-                    task_group TEXT DEFAULT 'no-group',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            print("Created tasks table")
+def get_shard_index(user_id):
+    count, previous = get_shard_state()
+    index = hash_shard(user_id, count)
+    if previous:
+        # while resharding, a user stays on the old shard until the tool has moved their rows
+        old_index = hash_shard(user_id, previous)
+        if old_index != index and has_user_rows(old_index, user_id):
+            return old_index
+    return index
+
+
+def get_shard_count():
+    count, previous = get_shard_state()
+    return max(count, previous or 0)
+
+
+def connect_user_db(user_id):
+    return connect_shard(get_shard_index(user_id))
+
+
+def init_database():
+    for index in range(get_shard_count()):
+        init_shard(index)
+
+
+def migrate_v1(cursor, index):
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_settings (
+            user_id INTEGER PRIMARY KEY,
+            theme TEXT DEFAULT 'light',
+            notifications_enabled BOOLEAN DEFAULT 1,
+            notification_time TEXT DEFAULT '12:00',
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            title TEXT NOT NULL,
+            description TEXT,
+            priority TEXT CHECK(priority IN ('low', 'medium', 'high')) DEFAULT 'medium',
+            start_date DATE,
+            end_date DATE,
+            complexity TEXT CHECK(complexity IN ('easy', 'medium', 'hard')) DEFAULT 'medium',
+            assignee TEXT,
+            status TEXT CHECK(status IN ('new', 'progress', 'done')) DEFAULT 'new',
+            task_group TEXT DEFAULT 'no-group',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS task_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            group_name TEXT NOT NULL,
+            description TEXT,
+            color TEXT DEFAULT '#3498db',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, group_name)
+        )
+    ''')
 
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='task_groups'")
+    # every shard hands out ids from its own range, so task ids stay unique across shards
+    for table in ('tasks', 'task_groups'):
+        cursor.execute("SELECT 1 FROM sqlite_sequence WHERE name = ?", (table,))
         if not cursor.fetchone():
-            cursor.execute('''
-                CREATE TABLE task_groups (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    group_name TEXT NOT NULL,
-                    description TEXT,
-                    color TEXT DEFAULT '#3498db',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    UNIQUE(user_id, group_name)
-                )
-            ''')
-            print("Created task_groups table")
+            cursor.execute("INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)",
+                           (table, index * SHARD_ID_SPAN))
+
+
+def migrate_v2(cursor, index):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at)')
+
+    # bumped by triggers on every task write, so cached per-user results know when they are stale
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    for event, row in (('INSERT', 'NEW'), ('UPDATE', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS tasks_version_{event.lower()} AFTER {event} ON tasks
+            BEGIN
+                INSERT INTO user_versions (user_id, version) VALUES ({row}.user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
+
+def migrate_v3(cursor, index):
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_status_end_date ON tasks (status, end_date)')
+
+    # one row per (task, threshold) already announced, so each deadline reminder is sent once
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS deadline_notifications (
+            task_id INTEGER NOT NULL,
+            threshold TEXT CHECK(threshold IN ('due_soon', 'overdue')) NOT NULL,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (task_id, threshold)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_deadline_notifications_delete AFTER DELETE ON tasks
+        BEGIN
+            DELETE FROM deadline_notifications WHERE task_id = OLD.id;
+        END
+    ''')
+
+
+def migrate_v4(cursor, index):
+    # tasks reference groups by id; the legacy tasks.task_group name column is no longer read or written
+    cursor.execute('ALTER TABLE tasks ADD COLUMN group_id INTEGER REFERENCES task_groups (id)')
+    cursor.execute('ALTER TABLE task_groups ADD COLUMN task_count INTEGER NOT NULL DEFAULT 0')
+
+    cursor.execute('''
+        INSERT OR IGNORE INTO task_groups (user_id, group_name)
+        SELECT DISTINCT user_id, task_group FROM tasks
+        WHERE task_group IS NOT NULL AND task_group NOT IN ('', 'no-group')
+    ''')
+    cursor.execute('''
+        UPDATE tasks SET group_id = (
+            SELECT g.id FROM task_groups g
+            WHERE g.user_id = tasks.user_id AND g.group_name = tasks.task_group
+        )
+        WHERE task_group IS NOT NULL AND task_group NOT IN ('', 'no-group')
+    ''')
+    cursor.execute('''
+        UPDATE task_groups SET task_count = (
+            SELECT COUNT(*) FROM tasks WHERE tasks.group_id = task_groups.id
+        )
+    ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_tasks_group ON tasks (group_id)')
+
+    # task_count is kept up to date by triggers, so listing groups never has to scan tasks
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_group_count_insert AFTER INSERT ON tasks
+        WHEN NEW.group_id IS NOT NULL
+        BEGIN
+            UPDATE task_groups SET task_count = task_count + 1 WHERE id = NEW.group_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_group_count_delete AFTER DELETE ON tasks
+        WHEN OLD.group_id IS NOT NULL
+        BEGIN
+            UPDATE task_groups SET task_count = task_count - 1 WHERE id = OLD.group_id;
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_group_count_update AFTER UPDATE OF group_id ON tasks
+        WHEN OLD.group_id IS NOT NEW.group_id
+        BEGIN
+            UPDATE task_groups SET task_count = task_count - 1 WHERE id = OLD.group_id;
+            UPDATE task_groups SET task_count = task_count + 1 WHERE id = NEW.group_id;
+        END
+    ''')
+
+    # renaming or deleting a group changes how the user's tasks read back, without touching them
+    for event, row in (('UPDATE OF group_name', 'NEW'), ('DELETE', 'OLD')):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS task_groups_version_{event.split()[0].lower()} AFTER {event} ON task_groups
+            BEGIN
+                INSERT INTO user_versions (user_id, version) VALUES ({row}.user_id, 1)
+                ON CONFLICT (user_id) DO UPDATE SET version = version + 1;
+            END
+        ''')
+
+
+def migrate_v5(cursor, index):
+    # resharding keeps task ids, so a shard can hold ids from other shards' ranges; AUTOINCREMENT
+    # would continue after the largest of them, so task ids are allocated from this counter instead
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS shard_sequence (
+            name TEXT PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        INSERT OR IGNORE INTO shard_sequence (name, seq)
+        SELECT 'tasks', COALESCE(MAX(id), ?) FROM tasks WHERE id >= ? AND id < ?
+    ''', (index * SHARD_ID_SPAN, index * SHARD_ID_SPAN, (index + 1) * SHARD_ID_SPAN))
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS tasks_shard_sequence AFTER INSERT ON tasks
+        WHEN NEW.id = (SELECT seq + 1 FROM shard_sequence WHERE name = 'tasks')
+        BEGIN
+            UPDATE shard_sequence SET seq = NEW.id WHERE name = 'tasks';
+        END
+    ''')
+
+
+# PRAGMA user_version of a shard is the number of migrations already applied to it
+SCHEMA_MIGRATIONS = [migrate_v1, migrate_v2, migrate_v3, migrate_v4, migrate_v5]
+
+
+def init_shard(index):
+    try:
+        conn = sqlite3.connect(shard_path(index), isolation_level=None)
+        cursor = conn.cursor()
+
+        # readers (API requests, backups) don't block the writer in WAL mode; the setting is persistent
+        cursor.execute('PRAGMA journal_mode=WAL')
+
+        version = cursor.execute('PRAGMA user_version').fetchone()[0]
+        if version >= len(SCHEMA_MIGRATIONS):
+            conn.close()
+            return
+
+        cursor.execute('BEGIN IMMEDIATE')
+        try:
+            # another process may have migrated the shard while we waited for the lock
+            version = cursor.execute('PRAGMA user_version').fetchone()[0]
+            for migration in SCHEMA_MIGRATIONS[version:]:
+                migration(cursor, index)
+            cursor.execute(f'PRAGMA user_version = {len(SCHEMA_MIGRATIONS)}')
+            cursor.execute('COMMIT')
+        except Exception:
+            cursor.execute('ROLLBACK')
+            raise
 
-        conn.commit()
         conn.close()
-        print("Database checked")
+        print(f"Database migrated to version {len(SCHEMA_MIGRATIONS)}: {shard_path(index)}")
     except Exception as e:
         print(f"Database check error: {e}")
 
 
+# (table, insert verb, target columns, source expressions[, row filter]); groups are copied first so that
+# tasks can be pointed at the ids their groups get on the target shard. Task ids are kept
+# as they are, so clients holding them keep working and a repeated copy is ignored
+RESHARD_TABLES = (
+    ('task_groups', 'INSERT OR IGNORE', ('user_id', 'group_name', 'description', 'color', 'created_at'), None),
+    ('tasks', 'INSERT OR IGNORE',
+     ('id', 'user_id', 'title', 'description', 'priority', 'start_date', 'end_date', 'complexity', 'assignee',
+      'status', 'created_at', 'updated_at', 'group_id'),
+     ('id', 'user_id', 'title', 'description', 'priority', 'start_date', 'end_date', 'complexity', 'assignee',
+      'status', 'created_at', 'updated_at',
+      '''(SELECT dg.id FROM main.task_groups dg JOIN src.task_groups sg
+          ON sg.user_id = dg.user_id AND sg.group_name = dg.group_name
+          WHERE sg.id = src.tasks.group_id)''')),
+    # kept task ids let already-sent deadline reminders follow the user to the new shard
+    ('deadline_notifications', 'INSERT OR IGNORE', ('task_id', 'threshold', 'sent_at'), None,
+     'task_id IN (SELECT id FROM {schema}tasks WHERE user_id = ?)'),
+    ('user_settings', 'INSERT OR REPLACE',
+     ('user_id', 'theme', 'notifications_enabled', 'notification_time', 'updated_at'), None),
+)
+
+
+def move_user(src_conn, dst_conn, user_id):
+    # SQLite only commits attached databases atomically outside WAL mode, so the move is
+    # two commits instead: copy into the target first, then delete from the source. The
+    # source write lock is held across both, so the API can't add rows we'd miss. A crash
+    # in between leaves the user on the source shard with a copy the next pass ignores.
+    src_conn.execute('BEGIN IMMEDIATE')
+    try:
+        for table, insert, columns, source, *row_filter in RESHARD_TABLES:
+            condition = row_filter[0].format(schema='src.') if row_filter else 'user_id = ?'
+            dst_conn.execute(f'{insert} INTO main.{table} ({", ".join(columns)}) '
+                             f'SELECT {", ".join(source or columns)} FROM src.{table} WHERE {condition}',
+                             (user_id,))
+        # the version must keep growing across shards, or /analytics could match a stale cache entry
+        dst_conn.execute('''
+            INSERT INTO main.user_versions (user_id, version)
+            SELECT user_id, version + 1 FROM src.user_versions WHERE user_id = ?
+            ON CONFLICT (user_id) DO UPDATE SET version = MAX(version, excluded.version)
+        ''', (user_id,))
+        dst_conn.commit()
+
+        for table, _, _, _, *row_filter in reversed(RESHARD_TABLES):
+            condition = row_filter[0].format(schema='') if row_filter else 'user_id = ?'
+            src_conn.execute(f'DELETE FROM {table} WHERE {condition}', (user_id,))
+        src_conn.execute('DELETE FROM user_versions WHERE user_id = ?', (user_id,))
+        src_conn.execute('COMMIT')
+    except Exception:
+        dst_conn.rollback()
+        src_conn.execute('ROLLBACK')
+        raise
+
+
+def reshard_pass(old_count, new_count):
+    moved = 0
+    for src_index in range(old_count):
+        src_conn = sqlite3.connect(shard_path(src_index), isolation_level=None)
+        user_ids = [row[0] for row in src_conn.execute('''
+            SELECT user_id FROM tasks
+            UNION SELECT user_id FROM task_groups
+            UNION SELECT user_id FROM user_settings
+        ''')]
+
+        by_shard = {}
+        for user_id in user_ids:
+            dst_index = hash_shard(user_id, new_count)
+            if dst_index != src_index:
+                by_shard.setdefault(dst_index, []).append(user_id)
+
+        for dst_index, shard_user_ids in by_shard.items():
+            dst_conn = sqlite3.connect(shard_path(dst_index))
+            dst_conn.execute('ATTACH DATABASE ? AS src', (shard_path(src_index),))
+            for user_id in shard_user_ids:
+                move_user(src_conn, dst_conn, user_id)
+            dst_conn.close()
+            moved += len(shard_user_ids)
+
+        src_conn.close()
+    return moved
+
+
+def reshard_database(new_count):
+    if not isinstance(new_count, int) or isinstance(new_count, bool) or new_count < 1:
+        print(f"Shard count must be a positive integer, got: {new_count!r}")
+        return False
+
+    count, previous = get_shard_state()
+    if previous:
+        if count != new_count:
+            print(f"Resharding {previous} -> {count} is still in progress, finish it first")
+            return False
+        old_count = previous
+        print(f"Resuming resharding {old_count} -> {new_count}")
+    else:
+        old_count = count
+        if old_count == new_count:
+            print(f"Already using {new_count} shards")
+            return True
+
+    # new shards need their tables before the API can route anyone to them
+    for index in range(max(old_count, new_count)):
+        init_shard(index)
+
+    if not previous:
+        save_shard_state(new_count, old_count)
+        print(f"Resharding {old_count} -> {new_count}")
+
+    # requests routed to the old shard just before a user was moved can leave
+    # stragglers behind, so keep sweeping until a pass finds nothing to move
+    moved = 0
+    while True:
+        moved_in_pass = reshard_pass(old_count, new_count)
+        moved += moved_in_pass
+        if not moved_in_pass:
+            break
+
+    save_shard_state(new_count)
+    moved += reshard_pass(old_count, new_count)
+
+    print(f"Resharding finished, users moved: {moved}")
+    return True
+
+
+_backup_lock = threading.Lock()
+
+
+def verify_database(path):
+    conn = sqlite3.connect(path)
+    try:
+        result = conn.execute('PRAGMA integrity_check').fetchone()[0]
+    finally:
+        conn.close()
+    return result == 'ok'
+
+
+class BackupRestartedError(Exception):
+    pass
+
+
+def copy_database(src_path, dst_path):
+    src = sqlite3.connect(src_path)
+    dst = sqlite3.connect(dst_path)
+    progress = {'remaining': None, 'restarts': 0}
+
+    def on_progress(status, remaining, total):
+        # sqlite starts the copy over whenever another connection writes to the source
+        if progress['remaining'] is not None and remaining > progress['remaining']:
+            progress['restarts'] += 1
+            if progress['restarts'] > BACKUP_MAX_RESTARTS:
+                raise BackupRestartedError()
+        progress['remaining'] = remaining
+
+        # backup(sleep=...) only waits after a BUSY/LOCKED step, so pause here to give
+        # writers a window between steps
+        if remaining:
+            time.sleep(BACKUP_STEP_SLEEP)
+
+    try:
+        # a few pages per step, releasing the source lock in between
+        src.backup(dst, pages=BACKUP_PAGES_PER_STEP, progress=on_progress)
+    except BackupRestartedError:
+        # under steady writes the stepped copy never finishes; in WAL mode a single step
+        # only holds a read snapshot, so writers keep going while it runs
+        print(f"Backup of {src_path} kept restarting, copying in one step")
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+def rotate_backups():
+    snapshots = list_backups()
+    for name in snapshots[:-BACKUP_KEEP]:
+        shutil.rmtree(os.path.join(BACKUP_DIR, name))
+        print(f"Old backup removed: {name}")
+
+    # leftovers of crashed or failed runs; recent ones may belong to a backup still running in another process
+    for name in os.listdir(BACKUP_DIR):
+        path = os.path.join(BACKUP_DIR, name)
+        if name.endswith('.partial') and time.time() - os.path.getmtime(path) > BACKUP_PARTIAL_MAX_AGE:
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"Stale partial backup removed: {name}")
+
+
+def list_backups():
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    return sorted(name for name in os.listdir(BACKUP_DIR)
+                  if not name.endswith('.partial') and os.path.isdir(os.path.join(BACKUP_DIR, name)))
+
+
+def backup_database():
+    if not _backup_lock.acquire(blocking=False):
+        print("Backup already running - skipping")
+        return None
+
+    partial_dir = None
+    try:
+        state_mtime = get_shard_state_mtime()
+        count, previous = get_shard_state()
+        if previous:
+            # users moving between shards would be missing or doubled in the snapshot
+            print("Resharding in progress - skipping backup")
+            return None
+
+        started = time.perf_counter()
+        # the CLI and the scheduled job can start a backup in the same second
+        name = f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}-{os.getpid()}"
+        partial_dir = os.path.join(BACKUP_DIR, name + '.partial')
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        os.makedirs(partial_dir)
+
+        for index in range(count):
+            snapshot_path = os.path.join(partial_dir, os.path.basename(shard_path(index)))
+            copy_database(shard_path(index), snapshot_path)
+            if not verify_database(snapshot_path):
+                print(f"Backup integrity check failed: {snapshot_path}")
+                shutil.rmtree(partial_dir)
+                return None
+
+        # resharding runs in its own process; if it started while we were copying, a user
+        # may have moved from a shard not yet copied to one already copied
+        if get_shard_state_mtime() != state_mtime:
+            print("Resharding started during backup - discarding snapshot")
+            shutil.rmtree(partial_dir)
+            return None
+
+        with open(os.path.join(partial_dir, os.path.basename(SHARD_STATE_PATH)), 'w') as f:
+            json.dump({'count': count}, f)
+
+        # the snapshot only gets its final name once every shard has been copied and verified
+        os.replace(partial_dir, os.path.join(BACKUP_DIR, name))
+        print(f"Backup {name} created in {time.perf_counter() - started:.1f} s")
+        rotate_backups()
+        return name
+    except Exception as e:
+        print(f"Backup error: {e}")
+        if partial_dir and os.path.isdir(partial_dir):
+            shutil.rmtree(partial_dir, ignore_errors=True)
+        return None
+    finally:
+        _backup_lock.release()
+
+
+def start_backup():
+    # run off the scheduler thread, so reminders are not delayed by a long backup
+    backup_thread = threading.Thread(target=run_profiled, args=('scheduler backup_database', backup_database))
+    backup_thread.daemon = True
+    backup_thread.start()
+
+
+def extra_shard_paths(count):
+    # shard files past the live count, including ones emptied by an earlier reshard
+    root, ext = os.path.splitext(DB_PATH)
+    prefix = os.path.basename(root) + '_'
+    directory = os.path.dirname(DB_PATH) or '.'
+    paths = []
+    for filename in os.listdir(directory):
+        index = filename[len(prefix):-len(ext)] if filename.startswith(prefix) and filename.endswith(ext) else ''
+        if index.isdigit() and int(index) >= count:
+            paths.append(os.path.join(directory, filename))
+    return paths
+
+
+# shards are overwritten one at a time and a running API keeps USER_IDS and the analytics
+# cache in memory, so the API and bot must be stopped before restoring
+def restore_database(name):
+    snapshot_dir = os.path.join(BACKUP_DIR, name)
+    state_path = os.path.join(snapshot_dir, os.path.basename(SHARD_STATE_PATH))
+    if not os.path.isfile(state_path):
+        print(f"Backup not found: {name}")
+        return False
+
+    with open(state_path) as f:
+        count = int(json.load(f).get('count', 1))
+
+    snapshot_paths = [os.path.join(snapshot_dir, os.path.basename(shard_path(index))) for index in range(count)]
+    for snapshot_path in snapshot_paths:
+        if not os.path.isfile(snapshot_path) or not verify_database(snapshot_path):
+            print(f"Backup integrity check failed: {snapshot_path}")
+            return False
+
+    print("Restoring - make sure the API is stopped")
+    for index, snapshot_path in enumerate(snapshot_paths):
+        copy_database(snapshot_path, shard_path(index))
+        print(f"Restored {shard_path(index)}")
+
+    # left in place, their rows would come back into live data on the next reshard
+    for path in extra_shard_paths(count):
+        for suffix in ('', '-wal', '-shm'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        print(f"Removed {path}")
+
+    save_shard_state(count)
+    print(f"Backup {name} restored")
+    return True
+
+
+def validate_date(date_str):
+    if not date_str:
+        return None
+    try:
+        # fromisoformat is much cheaper than strptime for the common zero-padded case
+        if len(date_str) == 10 and date_str[4] == '-' and date_str[7] == '-':
+            return date.fromisoformat(date_str).isoformat()
+        return datetime.strptime(date_str, '%Y-%m-%d').date().isoformat()
+    except ValueError:
+        print(f"Invalid date format: {date_str}")
+        return None
+
+
+def build_task_row(user_id, title, description, priority, start_date, end_date, complexity, assignee, status,
+                   task_group='no-group'):
+    if not title or not title.strip():
+        return None
+
+    return (
+        user_id,
+        title.strip(),
+        description.strip() if description else '',
+        priority if priority in ['low', 'medium', 'high'] else 'medium',
+        validate_date(start_date),
+        validate_date(end_date),
+        complexity if complexity in ['easy', 'medium', 'hard'] else 'medium',
+        assignee.strip() if assignee else '',
+        status if status in ['new', 'progress', 'done'] else 'new',
+        task_group if task_group and isinstance(task_group, str) else 'no-group'
+    )
+
+
+INSERT_TASK_SQL = '''
+    INSERT INTO tasks (id, user_id, title, description, priority, start_date, end_date, complexity, assignee, status, group_id)
+    VALUES ((SELECT seq + 1 FROM shard_sequence WHERE name = 'tasks'), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+# column order of the rows returned to the client, which indexes them by position
+TASK_COLUMNS_SQL = '''
+    t.id, t.user_id, t.title, t.description, t.priority, t.start_date, t.end_date, t.complexity, t.assignee,
+    t.status, COALESCE(g.group_name, 'no-group'), t.created_at, t.updated_at
+'''
+
+
+def resolve_group_id(cursor, user_id, group_name):
+    if not group_name or group_name == 'no-group':
+        return None
+    cursor.execute('INSERT OR IGNORE INTO task_groups (user_id, group_name) VALUES (?, ?)', (user_id, group_name))
+    cursor.execute('SELECT id FROM task_groups WHERE user_id = ? AND group_name = ?', (user_id, group_name))
+    return cursor.fetchone()[0]
+
+
 def save_task(user_id, title, description, priority, start_date, end_date, complexity, assignee, status,
               task_group='no-group'):
     try:
         print(f"Saving task for user_id: {user_id}")
 
-        if not title or not title.strip():
+        row = build_task_row(user_id, title, description, priority, start_date, end_date, complexity, assignee,
+                             status, task_group)
+        if not row:
             print(f"Empty task title for user {user_id}")
             return False
 
-        def validate_date(date_str):
-            if not date_str:
-                return None
-            try:
-                return datetime.strptime(date_str, '%Y-%m-%d').date().isoformat()
-            except ValueError:
-                print(f"Invalid date format: {date_str}")
-                return None
-
-        start_date = validate_date(start_date)
-        end_date = validate_date(end_date)
-
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
-        cursor.execute('''
-                INSERT INTO tasks (user_id, title, description, priority, start_date, end_date, complexity, assignee, status, task_group)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-            user_id,
-            title.strip(),
-            description.strip() if description else '',
-            priority if priority in ['low', 'medium', 'high'] else 'medium',
-            start_date,
-            end_date,
-            complexity if complexity in ['easy', 'medium', 'hard'] else 'medium',
-            assignee.strip() if assignee else '',
-            status if status in ['new', 'progress', 'done'] else 'new',
-            task_group
-        ))
+        cursor.execute(INSERT_TASK_SQL, row[:-1] + (resolve_group_id(cursor, user_id, row[-1]),))
         conn.commit()
         task_id = cursor.lastrowid
         print(f"Task saved with ID: {task_id}")
@@ -126,11 +870,136 @@ def save_task(user_id, title, description, priority, start_date, end_date, compl
         return False
 
 
+EXPORT_FIELDS = ('id', 'title', 'description', 'priority', 'start_date', 'end_date', 'complexity', 'assignee',
+                 'status', 'group', 'created_at', 'updated_at')
+EXPORT_CHUNK_SIZE = 500
+IMPORT_BATCH_SIZE = 1000
+
+
+def iter_export_rows(user_id):
+    conn = connect_user_db(user_id)
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT t.id, t.title, t.description, t.priority, t.start_date, t.end_date, t.complexity, t.assignee,
+                   t.status, COALESCE(g.group_name, 'no-group'), t.created_at, t.updated_at
+            FROM tasks t LEFT JOIN task_groups g ON g.id = t.group_id
+            WHERE t.user_id = ? ORDER BY t.id
+        ''', (user_id,))
+        while True:
+            rows = cursor.fetchmany(EXPORT_CHUNK_SIZE)
+            if not rows:
+                break
+            yield rows
+    finally:
+        conn.close()
+
+
+def export_tasks(user_id, export_format):
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_FIELDS)
+        for rows in iter_export_rows(user_id):
+            writer.writerows(rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in iter_export_rows(user_id):
+            yield ''.join(json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False) + '\n' for row in rows)
+
+
+def parse_import_records(lines, import_format):
+    if import_format == 'csv':
+        yield from csv.DictReader(lines)
+        return
+
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            record = None
+        yield record if isinstance(record, dict) else None
+
+
+def import_tasks(user_id, lines, import_format):
+    imported = 0
+    skipped = 0
+    batch = []
+    group_ids = {}
+    error = None
+
+    conn = connect_user_db(user_id)
+    try:
+        cursor = conn.cursor()
+        records = parse_import_records(lines, import_format)
+        while True:
+            # decoding and CSV parsing happen lazily here; a broken file stops the import
+            # but keeps what was read before it
+            try:
+                record = next(records)
+            except StopIteration:
+                break
+            except (UnicodeDecodeError, csv.Error) as e:
+                error = f"Malformed file: {e}"
+                break
+            try:
+                row = record and build_task_row(
+                    user_id,
+                    record.get('title'),
+                    record.get('description'),
+                    record.get('priority'),
+                    record.get('start_date'),
+                    record.get('end_date'),
+                    record.get('complexity'),
+                    record.get('assignee'),
+                    record.get('status'),
+                    record.get('group') or record.get('task_group')
+                )
+            except (AttributeError, TypeError):
+                # non-string values in an NDJSON record
+                row = None
+            if not row:
+                skipped += 1
+                continue
+
+            group_name = row[-1]
+            if group_name not in group_ids:
+                group_ids[group_name] = resolve_group_id(cursor, user_id, group_name)
+            batch.append(row[:-1] + (group_ids[group_name],))
+            if len(batch) >= IMPORT_BATCH_SIZE:
+                cursor.executemany(INSERT_TASK_SQL, batch)
+                conn.commit()
+                imported += len(batch)
+                batch = []
+
+        if batch:
+            cursor.executemany(INSERT_TASK_SQL, batch)
+            conn.commit()
+            imported += len(batch)
+    finally:
+        conn.close()
+
+    print(f"Imported tasks for user {user_id}: {imported}, skipped: {skipped}")
+    if error:
+        print(f"Import stopped early for user {user_id}: {error}")
+    return imported, skipped, error
+
+
 def get_tasks_by_user(user_id):
     try:
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
-        cursor.execute('SELECT * FROM tasks WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+        cursor.execute(f'''
+            SELECT {TASK_COLUMNS_SQL}
+            FROM tasks t LEFT JOIN task_groups g ON g.id = t.group_id
+            WHERE t.user_id = ? ORDER BY t.created_at DESC
+        ''', (user_id,))
         tasks = cursor.fetchall()
         conn.close()
         print(f"Found tasks for user {user_id}: {len(tasks)}")
@@ -140,16 +1009,16 @@ def get_tasks_by_user(user_id):
         return []
 
 
-def update_task_status(task_id, new_status):
+def update_task_status(user_id, task_id, new_status):
     try:
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM tasks WHERE id = ?", (task_id,))
+        cursor.execute("SELECT id FROM tasks WHERE id = ? AND user_id = ?", (task_id, user_id))
         if not cursor.fetchone():
             print(f"Task with ID {task_id} not found")
             return False
-        cursor.execute('UPDATE tasks SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
-                       (new_status, task_id))
+        cursor.execute('UPDATE tasks SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND user_id = ?',
+                       (new_status, task_id, user_id))
         conn.commit()
         conn.close()
         print(f"Task {task_id} status updated to: {new_status}")
@@ -159,15 +1028,15 @@ def update_task_status(task_id, new_status):
         return False
 
 
-def delete_task(task_id):
+def delete_task(user_id, task_id):
     try:
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
-        cursor.execute("SELECT id FROM tasks WHERE id = ?", (task_id,))
+        cursor.execute("SELECT id FROM tasks WHERE id = ? AND user_id = ?", (task_id, user_id))
         if not cursor.fetchone():
             print(f"Task with ID {task_id} not found")
             return False
-        cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+        cursor.execute("DELETE FROM tasks WHERE id = ? AND user_id = ?", (task_id, user_id))
         conn.commit()
         conn.close()
         print(f"Task {task_id} deleted")
@@ -179,7 +1048,7 @@ def delete_task(task_id):
 
 def get_task_statistics(user_id):
     try:
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT
@@ -213,9 +1082,122 @@ def get_task_statistics(user_id):
                 'by_assignee': {}}
 
 
+ANALYTICS_CACHE_SIZE = 256
+_analytics_cache = OrderedDict()
+_analytics_cache_lock = threading.Lock()
+
+
+def get_user_version(cursor, user_id):
+    cursor.execute('SELECT version FROM user_versions WHERE user_id = ?', (user_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def compute_task_analytics(cursor, user_id, start_date, end_date, today):
+    cursor.execute('''
+        WITH events AS (
+            SELECT date(created_at) AS day, 1 AS created, 0 AS completed
+            FROM tasks WHERE user_id = ?
+            UNION ALL
+            SELECT date(updated_at), 0, 1
+            FROM tasks WHERE user_id = ? AND status = 'done'
+        ),
+        daily AS (
+            SELECT day, SUM(created) AS created, SUM(completed) AS completed
+            FROM events GROUP BY day
+        ),
+        burndown AS (
+            SELECT day, created, completed,
+                   SUM(created - completed) OVER (ORDER BY day) AS open
+            FROM daily
+        )
+        SELECT day, created, completed, open FROM burndown
+        WHERE (? IS NULL OR day >= ?) AND (? IS NULL OR day <= ?)
+        ORDER BY day
+    ''', (user_id, user_id, start_date, start_date, end_date, end_date))
+    daily = [
+        {'date': day, 'created': created, 'completed': completed, 'open': open_tasks}
+        for day, created, completed, open_tasks in cursor.fetchall()
+    ]
+
+    def throughput(column, condition=''):
+        cursor.execute(f'''
+            SELECT {column},
+                   COUNT(*),
+                   SUM(t.status = 'done'),
+                   AVG(CASE WHEN t.status = 'done' THEN julianday(t.updated_at) - julianday(t.created_at) END)
+            FROM tasks t LEFT JOIN task_groups g ON g.id = t.group_id
+            WHERE t.user_id = ? {condition}
+            GROUP BY 1
+        ''', (user_id,))
+        return {
+            key: {
+                'total': total,
+                'completed': completed,
+                'completion_rate': round(completed / total * 100, 1),
+                'avg_cycle_days': round(cycle_days, 2) if cycle_days is not None else None
+            }
+            for key, total, completed, cycle_days in cursor.fetchall()
+        }
+
+    cursor.execute('''
+        SELECT COUNT(*),
+               SUM(status != 'done' AND end_date < ?),
+               SUM(status = 'done' AND date(updated_at) > end_date)
+        FROM tasks WHERE user_id = ? AND end_date IS NOT NULL
+    ''', (today, user_id))
+    with_deadline, overdue, completed_late = cursor.fetchone()
+    overdue = overdue or 0
+    completed_late = completed_late or 0
+
+    return {
+        'daily': daily,
+        'by_group': throughput("COALESCE(g.group_name, 'no-group')"),
+        'by_assignee': throughput('t.assignee', "AND t.assignee != ''"),
+        'deadlines': {
+            'with_deadline': with_deadline,
+            'overdue': overdue,
+            'completed_late': completed_late,
+            'overdue_rate': round((overdue + completed_late) / with_deadline * 100, 1) if with_deadline else 0
+        }
+    }
+
+
+def get_task_analytics(user_id, start_date=None, end_date=None):
+    try:
+        today = date.today().isoformat()
+        key = (user_id, start_date, end_date, today)
+
+        conn = connect_user_db(user_id)
+        cursor = conn.cursor()
+        version = get_user_version(cursor, user_id)
+
+        with _analytics_cache_lock:
+            cached = _analytics_cache.get(key)
+            if cached and cached[0] == version:
+                _analytics_cache.move_to_end(key)
+                conn.close()
+                return cached[1]
+
+        result = compute_task_analytics(cursor, user_id, start_date, end_date, today)
+        conn.close()
+
+        with _analytics_cache_lock:
+            _analytics_cache[key] = (version, result)
+            _analytics_cache.move_to_end(key)
+            while len(_analytics_cache) > ANALYTICS_CACHE_SIZE:
+                _analytics_cache.popitem(last=False)
+
+        print(f"Analytics computed for user {user_id}: {len(result['daily'])} days")
+        return result
+    except Exception as e:
+        print(f"Error getting analytics: {e}")
+        return None
+
+
 def get_user_settings(user_id):
     try:
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
         cursor.execute('SELECT * FROM user_settings WHERE user_id = ?', (user_id,))
         settings = cursor.fetchone()
@@ -249,7 +1231,7 @@ def save_user_settings(user_id, theme, notifications_enabled, notification_time)
                 notification_time = '12:00'
                 print(f"Invalid time, set to default: 12:00")
 
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
         cursor.execute('''
             INSERT OR REPLACE INTO user_settings
@@ -265,9 +1247,103 @@ def save_user_settings(user_id, theme, notifications_enabled, notification_time)
         return False
 
 
-def send_daily_reminders():
+def get_user_language(user_id):
     try:
-        conn = sqlite3.connect('tasks.db')
+        chat = get_bot().get_chat(user_id)
+        return chat.language_code if hasattr(chat, 'language_code') else 'en'
+    except:
+        return 'en'
+
+
+def get_deadline_candidates(index, today, due_soon_until, current_time):
+    conn = connect_shard(index)
+    cursor = conn.cursor()
+
+    # a single pass over idx_tasks_status_end_date covers every user on the shard
+    cursor.execute('''
+        SELECT t.id, t.user_id, t.title, t.end_date,
+               CASE WHEN t.end_date < ? THEN 'overdue' ELSE 'due_soon' END AS threshold
+        FROM tasks t
+        JOIN user_settings us ON us.user_id = t.user_id
+        WHERE t.status IN ('new', 'progress')
+            AND t.end_date IS NOT NULL AND t.end_date <= ?
+            AND us.notifications_enabled = 1 AND us.notification_time <= ?
+            AND NOT EXISTS (
+                SELECT 1 FROM deadline_notifications dn
+                WHERE dn.task_id = t.id
+                    AND dn.threshold = CASE WHEN t.end_date < ? THEN 'overdue' ELSE 'due_soon' END
+            )
+        ORDER BY t.user_id, t.end_date
+    ''', (today, due_soon_until, current_time, today))
+    rows = cursor.fetchall()
+
+    # during resharding a user's rows can briefly exist on two shards
+    rows = [row for row in rows if get_shard_index(row[1]) == index]
+
+    # marked before sending, so a task is announced at most once per threshold
+    cursor.executemany('INSERT OR IGNORE INTO deadline_notifications (task_id, threshold) VALUES (?, ?)',
+                       [(task_id, threshold) for task_id, _, _, _, threshold in rows])
+    conn.commit()
+    conn.close()
+
+    digests = {}
+    for task_id, user_id, title, end_date, threshold in rows:
+        digests.setdefault(user_id, []).append((title, end_date, threshold))
+    return digests
+
+
+def build_deadline_message(tasks, user_language):
+    is_ru = bool(user_language and user_language.startswith('ru'))
+    headers = {
+        'overdue': "Просроченные задачи:" if is_ru else "Overdue tasks:",
+        'due_soon': "Скоро срок выполнения:" if is_ru else "Due soon:",
+    }
+
+    lines = []
+    for threshold in ('overdue', 'due_soon'):
+        selected = [(title, end_date) for title, end_date, task_threshold in tasks if task_threshold == threshold]
+        if not selected:
+            continue
+        if lines:
+            lines.append('')
+        lines.append(headers[threshold])
+        for title, end_date in selected[:REMINDER_DIGEST_MAX_TASKS]:
+            lines.append(f"• {title} ({end_date})")
+        if len(selected) > REMINDER_DIGEST_MAX_TASKS:
+            more = len(selected) - REMINDER_DIGEST_MAX_TASKS
+            lines.append(f"...и ещё {more}" if is_ru else f"...and {more} more")
+
+    return '\n'.join(lines)
+
+
+def send_deadline_reminders():
+    try:
+        now = datetime.now()
+        today = now.date()
+        due_soon_until = date.fromordinal(today.toordinal() + REMINDER_DUE_SOON_DAYS).isoformat()
+        current_time = now.strftime('%H:%M')
+
+        digests = {}
+        for index in range(get_shard_count()):
+            digests.update(get_deadline_candidates(index, today.isoformat(), due_soon_until, current_time))
+
+        for user_id, tasks in digests.items():
+            message = build_deadline_message(tasks, get_user_language(user_id))
+            try:
+                get_bot().send_message(user_id, message)
+                print(f"Deadline reminder sent to user {user_id}: {len(tasks)} tasks")
+            except Exception as e:
+                print(f"Error sending deadline reminder to user {user_id}: {e}")
+
+    except Exception as e:
+        print(f"Deadline reminder error: {e}")
+
+
+def get_reminder_candidates():
+    candidates = []
+
+    for index in range(get_shard_count()):
+        conn = connect_shard(index)
         cursor = conn.cursor()
 
         cursor.execute('''
@@ -277,10 +1353,10 @@ def send_daily_reminders():
         ''')
         users = cursor.fetchall()
 
-        print(f"Users with notifications: {len(users)}")
-
         for user_id, notification_time in users:
-            print(f"Checking user {user_id}")
+            # during resharding a user's rows can briefly exist on two shards
+            if get_shard_index(user_id) != index:
+                continue
 
             cursor.execute('''
                 SELECT COUNT(*)
@@ -288,7 +1364,21 @@ def send_daily_reminders():
                 WHERE user_id = ? AND status IN ('new', 'progress')
             ''', (user_id,))
 
-            active_tasks_count = cursor.fetchone()[0]
+            candidates.append((user_id, notification_time, cursor.fetchone()[0]))
+
+        conn.close()
+
+    return candidates
+
+
+def send_daily_reminders():
+    try:
+        users = get_reminder_candidates()
+
+        print(f"Users with notifications: {len(users)}")
+
+        for user_id, notification_time, active_tasks_count in users:
+            print(f"Checking user {user_id}")
 
             if active_tasks_count == 0:
                 print(f"User {user_id} has no active tasks - skipping")
@@ -301,11 +1391,7 @@ def send_daily_reminders():
             if current_time == notification_time:
                 print(f"Time matched! Sending notification to user {user_id}")
 
-                try:
-                    chat = bot.get_chat(user_id)
-                    user_language = chat.language_code if hasattr(chat, 'language_code') else 'en'
-                except:
-                    user_language = 'en'
+                user_language = get_user_language(user_id)
 
                 if user_language and user_language.startswith('ru'):
                     message = f"У вас остались не законченные задачи\n\nВсего активных задач: {active_tasks_count}\nНе забудьте поработать над ними!"
@@ -313,21 +1399,21 @@ def send_daily_reminders():
                     message = f"You have unfinished tasks\n\nTotal active tasks: {active_tasks_count}\nDon't forget to work on them!"
 
                 try:
-                    bot.send_message(user_id, message)
+                    get_bot().send_message(user_id, message)
                     print(f"Notification sent to user {user_id}")
                 except Exception as e:
                     print(f"Error sending to user {user_id}: {e}")
             else:
                 print(f"Time not matched: {current_time} != {notification_time}")
 
-        conn.close()
-
     except Exception as e:
         print(f"Reminder system error: {e}")
 
 
 def run_scheduler():
-    schedule.every(1).minutes.do(send_daily_reminders)
+    schedule.every(1).minutes.do(run_profiled, 'scheduler send_daily_reminders', send_daily_reminders)
+    schedule.every(1).minutes.do(run_profiled, 'scheduler send_deadline_reminders', send_deadline_reminders)
+    schedule.every(BACKUP_INTERVAL_HOURS).hours.do(start_backup)
 
     print("Notification scheduler started")
 
@@ -336,8 +1422,9 @@ def run_scheduler():
         time.sleep(1)
 
 
-@bot.message_handler(commands=['start'])
 def start(message):
+    from telebot import types
+
     user_id = message.from_user.id
     global USER_IDS
 
@@ -359,7 +1446,7 @@ def start(message):
         ))
         keyboard.add(button2)
 
-        bot.send_message(
+        get_bot().send_message(
             message.chat.id,
             welcome_back_msg,
             reply_markup=keyboard
@@ -376,7 +1463,7 @@ def start(message):
     ))
     keyboard.add(button2)
 
-    bot.send_message(
+    get_bot().send_message(
         message.chat.id,
         welcome_msg,
         reply_markup=keyboard
@@ -400,7 +1487,7 @@ def is_authorized_user(user_id):
         return True
 
     try:
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
 
         cursor.execute('SELECT 1 FROM tasks WHERE user_id = ? LIMIT 1', (user_id,))
@@ -512,7 +1599,7 @@ def update_task_status_api():
         if not is_authorized_user(user_id):
             return jsonify({'error': 'User not authorized'}), 401
 
-        result = update_task_status(task_id, new_status)
+        result = update_task_status(user_id, task_id, new_status)
         if result:
             print(f"Task {task_id} status updated to: {new_status}")
             return jsonify({'status': 'success', 'message': 'Status updated successfully'})
@@ -537,7 +1624,7 @@ def delete_task_api():
         if not is_authorized_user(user_id):
             return jsonify({'error': 'User not authorized'}), 401
 
-        result = delete_task(task_id)
+        result = delete_task(user_id, task_id)
         if result:
             print(f"Task {task_id} deleted")
             return jsonify({'status': 'success', 'message': 'Task deleted successfully'})
@@ -566,6 +1653,28 @@ def get_statistics_api():
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@app.route('/analytics', methods=['GET'])
+def get_analytics_api():
+    try:
+        user_id = request.args.get('user_id', type=int)
+        start_date = validate_date(request.args.get('start_date'))
+        end_date = validate_date(request.args.get('end_date'))
+
+        if not user_id:
+            return jsonify({'error': 'User ID is required'}), 400
+
+        if not is_authorized_user(user_id):
+            return jsonify({'error': 'User not authorized'}), 401
+
+        analytics = get_task_analytics(user_id, start_date, end_date)
+        if analytics is None:
+            return jsonify({'error': 'Internal server error'}), 500
+        return jsonify(analytics)
+    except Exception as e:
+        print(f"Error getting analytics: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @app.route('/get_settings', methods=['GET'])
 def get_settings_api():
     try:
@@ -668,6 +1777,63 @@ def get_report_api():
         return jsonify({'error': 'Internal server error'}), 500
 
 
+@app.route('/export', methods=['GET'])
+def export_tasks_api():
+    try:
+        user_id = request.args.get('user_id', type=int)
+        export_format = request.args.get('format', 'ndjson')
+
+        if not user_id:
+            return jsonify({'error': 'User ID is required'}), 400
+
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({'error': 'Format must be ndjson or csv'}), 400
+
+        if not is_authorized_user(user_id):
+            return jsonify({'error': 'User not authorized'}), 401
+
+        mimetype = 'text/csv' if export_format == 'csv' else 'application/x-ndjson'
+        response = Response(stream_with_context(export_tasks(user_id, export_format)), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename=tasks.{export_format}'
+        return response
+    except Exception as e:
+        print(f"Error exporting tasks: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
+@app.route('/import', methods=['POST'])
+def import_tasks_api():
+    try:
+        user_id = request.args.get('user_id', type=int)
+        import_format = request.args.get('format')
+
+        if not user_id:
+            return jsonify({'error': 'User ID is required'}), 400
+
+        if not is_authorized_user(user_id):
+            return jsonify({'error': 'User not authorized'}), 401
+
+        # accept either a multipart upload or the raw file as the request body;
+        # the raw body stream is unbuffered and reads lines byte by byte without a wrapper
+        upload = request.files.get('file')
+        stream = upload.stream if upload else io.BufferedReader(request.stream)
+        if not import_format:
+            filename = upload.filename if upload else ''
+            is_csv = filename.endswith('.csv') or request.mimetype == 'text/csv'
+            import_format = 'csv' if is_csv else 'ndjson'
+
+        if import_format not in ('ndjson', 'csv'):
+            return jsonify({'error': 'Format must be ndjson or csv'}), 400
+
+        imported, skipped, error = import_tasks(user_id, codecs.iterdecode(stream, 'utf-8-sig'), import_format)
+        if error:
+            return jsonify({'error': error, 'imported': imported, 'skipped': skipped}), 400
+        return jsonify({'status': 'success', 'imported': imported, 'skipped': skipped})
+    except Exception as e:
+        print(f"Error importing tasks: {e}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+
 @app.route('/update_task_group', methods=['POST'])
 def update_task_group():
     try:
@@ -679,10 +1845,10 @@ def update_task_group():
         if not task_id or not new_group or not user_id:
             return jsonify({'error': 'Task ID, group and user ID are required'}), 400
 
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
-        cursor.execute('UPDATE tasks SET task_group = ? WHERE id = ? AND user_id = ?',
-                       (new_group, task_id, user_id))
+        cursor.execute('UPDATE tasks SET group_id = ? WHERE id = ? AND user_id = ?',
+                       (resolve_group_id(cursor, user_id, new_group), task_id, user_id))
         conn.commit()
         conn.close()
 
@@ -702,7 +1868,7 @@ def test_reminder(user_id):
         if not is_authorized_user(user_id):
             return jsonify({'error': 'User not authorized'}), 401
 
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
         cursor.execute('''
             SELECT COUNT(*)
@@ -718,7 +1884,7 @@ def test_reminder(user_id):
             message += f"Total active tasks: {active_tasks_count}\n"
             message += "Don't forget to work on them!"
 
-            bot.send_message(user_id, message)
+            get_bot().send_message(user_id, message)
             return jsonify({'status': 'success', 'message': f'Sent reminder about {active_tasks_count} tasks'})
         else:
             return jsonify({'status': 'info', 'message': 'No active tasks found'})
@@ -737,10 +1903,11 @@ def save_group():
         if not user_id or not group_name:
             return jsonify({'error': 'User ID and group name are required'}), 400
 
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
+        # OR REPLACE would give an existing group a new id and detach its tasks
         cursor.execute('''
-            INSERT OR REPLACE INTO task_groups (user_id, group_name)
+            INSERT OR IGNORE INTO task_groups (user_id, group_name)
             VALUES (?, ?)
         ''', (user_id, group_name))
         conn.commit()
@@ -761,12 +1928,11 @@ def delete_group():
         if not user_id or not group_name:
             return jsonify({'error': 'User ID and group name are required'}), 400
 
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
 
-        cursor.execute('UPDATE tasks SET task_group = ? WHERE user_id = ? AND task_group = ?',
-                       ('no-group', user_id, group_name))
-
+        # tasks are left pointing at the deleted id, which reads back as 'no-group';
+        # group ids are never reused, so this needs no rewrite of the tasks table
         cursor.execute('DELETE FROM task_groups WHERE user_id = ? AND group_name = ?',
                        (user_id, group_name))
 
@@ -778,6 +1944,42 @@ def delete_group():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/rename_group', methods=['POST'])
+def rename_group():
+    try:
+        data = request.json
+        user_id = data.get('user_id')
+        group_name = data.get('group_name')
+        new_name = data.get('new_name')
+
+        if not user_id or not group_name or not new_name:
+            return jsonify({'error': 'User ID, group name and new name are required'}), 400
+
+        if new_name == 'no-group':
+            return jsonify({'error': 'Group name is reserved'}), 400
+
+        if not is_authorized_user(user_id):
+            return jsonify({'error': 'User not authorized'}), 401
+
+        conn = connect_user_db(user_id)
+        cursor = conn.cursor()
+        try:
+            cursor.execute('UPDATE task_groups SET group_name = ? WHERE user_id = ? AND group_name = ?',
+                           (new_name, user_id, group_name))
+        except sqlite3.IntegrityError:
+            conn.close()
+            return jsonify({'error': 'Group already exists'}), 409
+        renamed = cursor.rowcount
+        conn.commit()
+        conn.close()
+
+        if not renamed:
+            return jsonify({'error': 'Group not found'}), 404
+        return jsonify({'status': 'success', 'message': 'Group renamed'})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
 @app.route('/get_groups', methods=['GET'])
 def get_groups():
     try:
@@ -785,10 +1987,13 @@ def get_groups():
         if not user_id:
             return jsonify({'error': 'User ID is required'}), 400
 
-        conn = sqlite3.connect('tasks.db')
+        conn = connect_user_db(user_id)
         cursor = conn.cursor()
-        cursor.execute('SELECT group_name FROM task_groups WHERE user_id = ?', (user_id,))
-        groups = [row[0] for row in cursor.fetchall()]
+        cursor.execute('SELECT id, group_name, color, task_count FROM task_groups WHERE user_id = ?', (user_id,))
+        groups = [
+            {'id': group_id, 'name': group_name, 'color': color, 'task_count': task_count}
+            for group_id, group_name, color, task_count in cursor.fetchall()
+        ]
         conn.close()
 
         return jsonify(groups)
@@ -796,6 +2001,66 @@ def get_groups():
         return jsonify({'error': str(e)}), 500
 
 
+@app.before_request
+def admit_request():
+    if request.method == 'OPTIONS' or request.path in RATE_LIMIT_EXEMPT_PATHS:
+        return None
+
+    budget = 'read' if request.method in ('GET', 'HEAD') else 'write'
+    keys = [('ip', budget, request.remote_addr)]
+
+    user_id = request.args.get('user_id') or request.view_args and request.view_args.get('user_id')
+    if not user_id and request.is_json:
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            user_id = data.get('user_id')
+    if user_id:
+        keys.append(('user', budget, str(user_id)))
+
+    retry_after = take_rate_tokens(keys)
+    if retry_after:
+        response = jsonify({'error': 'Too many requests'})
+        response.headers['Retry-After'] = str(math.ceil(retry_after))
+        return response, 429
+
+    # a bounded number of requests run at once, the rest wait briefly for a slot
+    if not _request_slots.acquire(timeout=REQUEST_QUEUE_TIMEOUT):
+        response = jsonify({'error': 'Server is busy'})
+        response.headers['Retry-After'] = '1'
+        return response, 429
+    g.request_slot = True
+    return None
+
+
+@app.teardown_request
+def release_request_slot(exception=None):
+    if g.pop('request_slot', False):
+        _request_slots.release()
+
+
+@app.before_request
+def start_request_profile():
+    debug_token = request.headers.get('X-Debug-Profile')
+    force = bool(ADMIN_TOKEN and debug_token and hmac.compare_digest(debug_token.encode(), ADMIN_TOKEN.encode()))
+    g.profile = start_profile(f"{request.method} {request.path}", force)
+
+
+@app.teardown_request
+def finish_request_profile(exception=None):
+    profile = g.pop('profile', None)
+    if profile:
+        finish_profile(profile)
+
+
+@app.route('/admin/profiles', methods=['GET'])
+def get_profiles_api():
+    admin_token = request.headers.get('X-Admin-Token')
+    if not ADMIN_TOKEN or not admin_token or not hmac.compare_digest(admin_token.encode(), ADMIN_TOKEN.encode()):
+        return jsonify({'error': 'Not authorized'}), 403
+
+    return jsonify({'sample_rate': PROFILE_SAMPLE_RATE, 'profiles': get_slow_profiles()})
+
+
 @app.after_request
 def after_request(response):
     response.headers.add('Access-Control-Allow-Origin', 'https://gm2gg.github.io')
@@ -821,21 +2086,34 @@ def options_handler(path=None):
 
 
 if __name__ == '__main__':
+    if len(sys.argv) == 3 and sys.argv[1] == 'reshard':
+        if not sys.argv[2].isdigit():
+            print(f"Shard count must be a positive integer, got: {sys.argv[2]}")
+            sys.exit(1)
+        sys.exit(0 if reshard_database(int(sys.argv[2])) else 1)
+
+    if len(sys.argv) == 2 and sys.argv[1] == 'backup':
+        sys.exit(0 if backup_database() else 1)
+
+    if len(sys.argv) == 2 and sys.argv[1] == 'list_backups':
+        print('\n'.join(list_backups()))
+        sys.exit(0)
+
+    if len(sys.argv) == 3 and sys.argv[1] == 'restore':
+        sys.exit(0 if restore_database(sys.argv[2]) else 1)
+
+    imported_at = time.perf_counter()
     init_database()
+    database_ready_at = time.perf_counter()
 
     print("Server starting...")
 
-    flask_thread = threading.Thread(
-        target=app.run,
-        kwargs={
-            'host': HOST,
-            'port': PORT,
-            'debug': False,
-            'use_reloader': False
-        }
-    )
+    # bind the socket here rather than inside the thread, so "started" means accepting requests
+    server = make_server(HOST, PORT, app, threaded=True)
+    flask_thread = threading.Thread(target=server.serve_forever)
     flask_thread.daemon = True
     flask_thread.start()
+    listening_at = time.perf_counter()
 
     scheduler_thread = threading.Thread(target=run_scheduler)
     scheduler_thread.daemon = True
@@ -843,11 +2121,15 @@ if __name__ == '__main__':
 
     print("Server started!")
     print(f"API available on port {PORT}")
-    print("Telegram bot active")
+    print(f"Startup time: imports {(imported_at - PROCESS_STARTED) * 1000:.1f} ms, "
+          f"database {(database_ready_at - imported_at) * 1000:.1f} ms, "
+          f"listening after {(listening_at - PROCESS_STARTED) * 1000:.1f} ms")
     print("Notification scheduler running")
     print(f"Active users: {len(USER_IDS)}")
 
     try:
+        bot = get_bot()
+        print("Telegram bot active")
         bot.polling(none_stop=True, interval=0)
     except Exception as e:
         print(f"Error in Telegram bot: {e}")
@@ -0,0 +1,74 @@
+import os
+import sys
+import time
+import random
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+os.chdir(tempfile.mkdtemp(prefix='do-lister-bench-'))
+
+import app
+
+USERS = 200
+TASKS_PER_USER = 500
+WORKERS = 4
+BASELINE_SECONDS = 5
+
+
+def seed():
+    app.init_database()
+    conn = app.connect_shard(0)
+    for user_id in range(1, USERS + 1):
+        app.USER_IDS.add(user_id)
+        conn.executemany(app.INSERT_TASK_SQL, [
+            (user_id, f"task {i}", 'x' * 200, 'medium', None, None, 'medium', '', 'new', None)
+            for i in range(TASKS_PER_USER)
+        ])
+    conn.commit()
+    conn.close()
+    print(f"Database size: {os.path.getsize(app.DB_PATH) / 1024 / 1024:.1f} MB")
+
+
+def worker(stop, latencies):
+    client = app.app.test_client()
+    while not stop.is_set():
+        user_id = random.randint(1, USERS)
+        started = time.perf_counter()
+        if random.random() < 0.2:
+            client.post('/save_task', json={'user_id': user_id, 'title': 'bench'})
+        else:
+            client.get(f'/get_statistics?user_id={user_id}')
+        latencies.append(time.perf_counter() - started)
+
+
+def measure(action):
+    stop = threading.Event()
+    latencies = []
+    threads = [threading.Thread(target=worker, args=(stop, latencies)) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    action()
+    elapsed = time.perf_counter() - started
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99)] * 1000
+    print(f"  {elapsed:.1f} s, {len(latencies)} requests, "
+          f"p50 {p50:.1f} ms, p99 {p99:.1f} ms, max {latencies[-1] * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    # the benchmark measures the database, not the rate limiter
+    app.RATE_LIMITS = {key: (10 ** 9, 10 ** 9) for key in app.RATE_LIMITS}
+    app.print = lambda *args, **kwargs: None
+    seed()
+
+    print("Without backup:")
+    measure(lambda: time.sleep(BASELINE_SECONDS))
+    print("During backup:")
+    measure(app.backup_database)